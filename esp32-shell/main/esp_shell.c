@@ -31,6 +31,7 @@
 #include "freertos/task.h"
 #include "esp_system.h"
 #include "esp_chip_info.h"
+#include "esp_app_desc.h"
 #include "esp_flash.h"
 #include "esp_log.h"
 #include "esp_spiffs.h"
@@ -322,6 +323,10 @@ static int cmd_info(int argc, char **argv) {
     uint32_t flash_size = 0;
     esp_flash_get_size(NULL, &flash_size);
     
+    /* SHA256 of the running app's ELF, identifies the exact firmware build */
+    char elf_sha[65];
+    esp_app_get_elf_sha256(elf_sha, sizeof(elf_sha));
+    
     printf("ESP32 System Information\n");
     printf("------------------------\n");
     printf("Chip:         ESP32 with %d CPU cores\n", chip_info.cores);
@@ -332,6 +337,7 @@ static int cmd_info(int argc, char **argv) {
            (chip_info.features & CHIP_FEATURE_EMB_FLASH) ? "(embedded)" : "(external)");
     printf("Free heap:    %lu bytes\n", (unsigned long)esp_get_free_heap_size());
     printf("IDF version:  %s\n", esp_get_idf_version());
+    printf("App SHA256:   %s\n", elf_sha);
     
     return 0;
 }
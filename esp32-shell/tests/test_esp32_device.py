@@ -10,6 +10,10 @@ Usage:
     python3 test_esp32_device.py /dev/ttyACM0 -v           # Verbose
     python3 test_esp32_device.py /dev/ttyACM0 -t basic     # Run specific tests
     python3 test_esp32_device.py /dev/ttyACM0 --baud 115200
+    python3 test_esp32_device.py /dev/ttyUSB0 --baud 921600  # High-rate firmware
+    python3 test_esp32_device.py /dev/ttyUSB0 --wait-scale 0.25  # Fast board
+    python3 test_esp32_device.py /dev/ttyACM0 --replay-cache .replay.json
+    python3 test_esp32_device.py /dev/ttyACM0 /dev/ttyACM1  # One board per port
 
 Requirements:
     pip install pyserial
@@ -19,11 +23,27 @@ Note: The ESP32 must be running the shell firmware before running tests.
 """
 
 import argparse
+import concurrent.futures
+import functools
+import io
+import json
+import os
 import serial
 import time
 import sys
 import re
-from typing import Optional, Tuple, List
+import select
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, List, Dict
+
+# Expected-output patterns, compiled once instead of lower()-ing each output
+_RE_ERROR = re.compile(r"error", re.IGNORECASE)
+_RE_MEMORY = re.compile(r"heap|bytes|free", re.IGNORECASE)
+_RE_UPTIME = re.compile(r"up|second|:", re.IGNORECASE)
+_RE_SYSINFO = re.compile(r"esp32|chip|idf", re.IGNORECASE)
+_RE_FSINFO = re.compile(r"total|free|used", re.IGNORECASE)
+_RE_UNKNOWN_CMD = re.compile(r"unknown|not found|error", re.IGNORECASE)
+_RE_APP_SHA = re.compile(r"App SHA256:\s*([0-9a-f]{64})")
 
 # ANSI colors for output
 class Colors:
@@ -33,51 +53,118 @@ class Colors:
     BLUE = '\033[0;34m'
     NC = '\033[0m'  # No Color
 
+# Test outcomes: every test returns one (name, status, reason) record
+PASS, FAIL, SKIP = "pass", "fail", "skip"
+TestRecord = Tuple[str, str, str]
+
 # Test result tracking
+@dataclass
 class TestResults:
-    def __init__(self):
-        self.run = 0
-        self.passed = 0
-        self.failed = 0
-        self.skipped = 0
-        self.failures: List[str] = []
-
-results = TestResults()
+    run: int = 0
+    passed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    failures: List[str] = field(default_factory=list)
+    
+    @classmethod
+    def from_records(cls, records: List[TestRecord], prefix: str = "") -> "TestResults":
+        """Count recorded outcomes, tagging failures with prefix."""
+        res = cls(run=len(records))
+        for name, status, _ in records:
+            if status == PASS:
+                res.passed += 1
+            elif status == FAIL:
+                res.failed += 1
+                res.failures.append(prefix + name)
+            else:
+                res.skipped += 1
+        return res
+    
+    def merge(self, other: "TestResults"):
+        """Add another run's counts."""
+        self.run += other.run
+        self.passed += other.passed
+        self.failed += other.failed
+        self.skipped += other.skipped
+        self.failures.extend(other.failures)
+
+# Log line prefixes, rendered and encoded once
+_INFO_PREFIX = f"{Colors.BLUE}[INFO]{Colors.NC} ".encode()
+_PASS_PREFIX = f"{Colors.GREEN}[PASS]{Colors.NC} ".encode()
+_FAIL_PREFIX = f"{Colors.RED}[FAIL]{Colors.NC} ".encode()
+_SKIP_PREFIX = f"{Colors.YELLOW}[SKIP]{Colors.NC} ".encode()
+_SEP = b" - "
+_NL = b"\n"
+
+# Log lines are collected here and written to stdout once per category
+_log_buffer = io.BytesIO()
+
+def flush_log():
+    """Write buffered log lines to stdout in a single write."""
+    data = _log_buffer.getvalue()
+    if data:
+        _log_buffer.seek(0)
+        _log_buffer.truncate()
+        # Keep ordering with anything print() has buffered on the text layer
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
 
 def log_info(msg: str):
-    print(f"{Colors.BLUE}[INFO]{Colors.NC} {msg}")
+    _log_buffer.write(_INFO_PREFIX + msg.encode() + _NL)
 
-def log_pass(name: str):
-    print(f"{Colors.GREEN}[PASS]{Colors.NC} {name}")
-    results.passed += 1
+def log_pass(name: str) -> TestRecord:
+    _log_buffer.write(_PASS_PREFIX + name.encode() + _NL)
+    return (name, PASS, "")
 
-def log_fail(name: str, reason: str = ""):
-    msg = f"{Colors.RED}[FAIL]{Colors.NC} {name}"
+def log_fail(name: str, reason: str = "") -> TestRecord:
     if reason:
-        msg += f" - {reason}"
-    print(msg)
-    results.failed += 1
-    results.failures.append(name)
+        _log_buffer.write(_FAIL_PREFIX + name.encode() + _SEP + reason.encode() + _NL)
+    else:
+        _log_buffer.write(_FAIL_PREFIX + name.encode() + _NL)
+    return (name, FAIL, reason)
 
-def log_skip(name: str, reason: str = ""):
-    msg = f"{Colors.YELLOW}[SKIP]{Colors.NC} {name}"
+def log_skip(name: str, reason: str = "") -> TestRecord:
     if reason:
-        msg += f" - {reason}"
-    print(msg)
-    results.skipped += 1
+        _log_buffer.write(_SKIP_PREFIX + name.encode() + _SEP + reason.encode() + _NL)
+    else:
+        _log_buffer.write(_SKIP_PREFIX + name.encode() + _NL)
+    return (name, SKIP, reason)
+
+@functools.lru_cache(maxsize=128)
+def _encode_cmd(cmd: str) -> bytes:
+    """Encode a command line with its CRLF terminator."""
+    return (cmd + "\r\n").encode('utf-8')
 
 class ESP32Shell:
     """Serial connection to ESP32 shell."""
     
-    def __init__(self, port: str, baud: int = 115200, timeout: float = 2.0):
+    def __init__(self, port: str, baud: int = 115200, timeout: float = 2.0,
+                 wait_scale: float = 1.0):
         self.port = port
         self.baud = baud
         self.timeout = timeout
+        # Multiplier for each command's prompt wait, < 1.0 for fast boards;
+        # connect and sync/probe windows are never scaled
+        self.wait_scale = wait_scale
         self.ser: Optional[serial.Serial] = None
         self.prompt = "esp32>"
+        # Bytes read past the last prompt, handed to the next read
+        self._pending = b""
+        # True while the last read ended on a prompt, i.e. nothing stale is
+        # left in the input stream for the next command to pick up
+        self._at_prompt = False
+        # Counter that makes every sync marker unique
+        self._probe_id = 0
+        # Output of stateless commands, valid for the current connection only
+        self._cmd_cache: Dict[str, str] = {}
+        # Tests that already passed on this board's firmware ({test: "pass"}),
+        # or None when --replay-cache is off or the firmware is unknown
+        self.replay_passed: Optional[Dict[str, str]] = None
         
     def connect(self) -> bool:
         """Open serial connection."""
+        self._cmd_cache.clear()
         try:
             self.ser = serial.Serial(
                 port=self.port,
@@ -85,375 +172,687 @@ class ESP32Shell:
                 timeout=self.timeout,
                 write_timeout=self.timeout
             )
+            self._enable_low_latency()
             # Clear any buffered data
             time.sleep(0.1)
-            self.ser.reset_input_buffer()
+            self._reset_input()
             self.ser.reset_output_buffer()
             return True
         except serial.SerialException as e:
             log_info(f"Failed to open {self.port}: {e}")
             return False
     
+    def _enable_low_latency(self):
+        """Ask the USB-serial driver to hand over small reads immediately.
+
+        FTDI/CP210x/CH340 bridges hold received bytes for up to 16 ms by
+        default, which adds that much to every command round trip.
+        """
+        try:
+            # Linux only: sets ASYNC_LOW_LATENCY via TIOCGSERIAL/TIOCSSERIAL
+            self.ser.set_low_latency_mode(True)
+            return
+        except (AttributeError, NotImplementedError, ValueError, OSError):
+            pass
+        
+        # Fall back to the usb-serial latency timer in sysfs (ms, 1 = lowest)
+        tty = os.path.basename(os.path.realpath(self.port))
+        try:
+            with open(f"/sys/bus/usb-serial/devices/{tty}/latency_timer", "w") as f:
+                f.write("1")
+        except OSError:
+            pass
+    
+    def set_baud(self, baud: int):
+        """Change baud rate, reconfiguring the port if it is open."""
+        self.baud = baud
+        if self.ser and self.ser.is_open:
+            self.ser.baudrate = baud
+            self._reset_input()
+    
     def disconnect(self):
         """Close serial connection."""
+        self._cmd_cache.clear()
         if self.ser and self.ser.is_open:
             self.ser.close()
     
+    def _reset_input(self):
+        """Discard everything received so far."""
+        self.ser.reset_input_buffer()
+        self._pending = b""
+        self._at_prompt = False
+    
+    def _wait_readable(self, timeout: float) -> bool:
+        """Block until received bytes are available or timeout expires."""
+        if os.name == 'nt':
+            # Windows serial handles cannot be passed to select()
+            start = time.time()
+            while not self.ser.in_waiting:
+                if (time.time() - start) >= timeout:
+                    return False
+                time.sleep(0.01)
+            return True
+        
+        ready, _, _ = select.select([self.ser.fileno()], [], [], timeout)
+        return bool(ready)
+    
+    def _read_until_prompt(self, timeout: float, keep: bool = True) -> bytearray:
+        """Block until the shell prompt arrives or timeout expires.
+        
+        Wakes as soon as bytes arrive and takes everything queued per read
+        instead of going byte by byte like Serial.read_until(); bytes past
+        the prompt are kept for the next call. With keep=False only enough
+        of the tail to match a split prompt is held on to.
+        """
+        prompt = self.prompt.encode('utf-8')
+        buf = bytearray(self._pending)
+        self._pending = b""
+        end = buf.find(prompt)
+        
+        start = time.time()
+        while end < 0:
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0 or not self._wait_readable(remaining):
+                break
+            # Only rescan the tail a prompt could straddle
+            scanned = max(len(buf) - len(prompt) + 1, 0)
+            buf += self.ser.read(self.ser.in_waiting or 1)
+            end = buf.find(prompt, scanned)
+            if end < 0 and not keep:
+                del buf[:-(len(prompt) - 1)]
+        
+        self._at_prompt = end >= 0
+        if end >= 0:
+            end += len(prompt)
+            self._pending = bytes(buf[end:])
+            del buf[end:]
+        return buf
+    
+    def _write_command(self, data: bytes):
+        """Write command bytes, first resyncing if out of step."""
+        # An earlier read gave up before its prompt; the rest of that output
+        # may still be in flight, so dropping what has arrived is not enough
+        if not self._at_prompt:
+            self.assert_prompt()
+        
+        # No flush(): the prompt coming back already proves the bytes went out
+        self.ser.write(data)
+    
+    def drain(self):
+        """Block until everything written has left the OS transmit buffer."""
+        if self.ser and self.ser.is_open:
+            self.ser.flush()
+    
+    def _command_timeout(self, wait_time: float) -> float:
+        """Upper bound on how long to wait for a command's prompt."""
+        return max(self.timeout, wait_time) * self.wait_scale
+    
     def send_command(self, cmd: str, wait_time: float = 0.5) -> str:
-        """Send command and return output."""
+        """Send command and return output up to the next prompt.
+        
+        Returns as soon as the prompt is seen; wait_time only raises the
+        upper bound for slow commands above the serial timeout, and
+        wait_scale then scales that bound.
+        """
         if not self.ser or not self.ser.is_open:
             return ""
         
-        # Clear input buffer
-        self.ser.reset_input_buffer()
-        
         # Send command with newline
-        self.ser.write((cmd + "\r\n").encode('utf-8'))
-        self.ser.flush()
+        self._write_command(_encode_cmd(cmd))
         
-        # Wait for response
-        time.sleep(wait_time)
+        # Read until the shell prints its prompt again
+        output = self._read_until_prompt(self._command_timeout(wait_time))
+        return output.decode('utf-8', errors='replace')
+    
+    def firmware_hash(self) -> Optional[str]:
+        """Return the running image's ELF SHA256 as reported by info."""
+        output = self.send_command_cached("info", wait_time=1.0, cacheable=True)
+        match = _RE_APP_SHA.search(output)
+        return match.group(1) if match else None
+    
+    def send_command_discard(self, cmd: str, wait_time: float = 0.5) -> bool:
+        """Send command and skip its output; True if the prompt came back."""
+        if not self.ser or not self.ser.is_open:
+            return False
         
-        # Read all available output
-        output = ""
-        while self.ser.in_waiting:
-            output += self.ser.read(self.ser.in_waiting).decode('utf-8', errors='replace')
-            time.sleep(0.05)
+        self._write_command(_encode_cmd(cmd))
+        self._read_until_prompt(self._command_timeout(wait_time), keep=False)
+        return self._at_prompt
+    
+    def send_command_cached(self, cmd: str, wait_time: float = 0.5,
+                            cacheable: bool = False) -> str:
+        """Send command, reusing earlier output if cmd is cacheable.
         
+        Only mark commands whose output cannot change during a connection
+        (help, info); anything touched by set/cd/touch/rm must not be cached.
+        """
+        if cmd in self._cmd_cache:
+            return self._cmd_cache[cmd]
+        
+        output = self.send_command(cmd, wait_time)
+        # The echoed command makes even a timed-out read non-empty, so
+        # only a read that reached its prompt is complete enough to keep
+        if cacheable and self._at_prompt:
+            self._cmd_cache[cmd] = output
         return output
     
+    def send_commands(self, cmds: List[str], wait_time: float = 0.5) -> List[str]:
+        """Send several commands in one write and return each one's output.
+        
+        The shell queues the lines and answers them in order, so one prompt
+        is read back per command.
+        """
+        if not self.ser or not self.ser.is_open:
+            return [""] * len(cmds)
+        
+        # Send all commands back to back
+        self._write_command(b"".join(_encode_cmd(cmd) for cmd in cmds))
+        
+        timeout = self._command_timeout(wait_time)
+        outputs = []
+        for _ in cmds:
+            outputs.append(self._read_until_prompt(timeout).decode('utf-8', errors='replace'))
+            # Past a timed-out read the next prompt is the late one, not
+            # this command's; leave the rest empty so the next write resyncs
+            if not self._at_prompt:
+                break
+        return outputs + [""] * (len(cmds) - len(outputs))
+    
     def wait_for_prompt(self, timeout: float = 5.0) -> bool:
         """Wait for shell prompt to appear."""
         if not self.ser:
             return False
-            
+        
+        self._read_until_prompt(timeout)
+        return self._at_prompt
+    
+    def _probe(self, timeout: float) -> bool:
+        """Echo a unique marker and consume input up to its reply.
+        
+        Prompts left over from earlier commands come back first and are
+        discarded; only the prompt after the marker's own output proves
+        the next command's output will be its own.
+        """
+        self._probe_id += 1
+        marker = f"__sync_{self._probe_id}__".encode('utf-8')
+        # The marker alone on a line is the output; the echoed command has
+        # "echo " before it
+        reply = re.compile(rb"(?:^|\n)" + marker + rb"\r?\n")
+        self.ser.write(b"echo " + marker + b"\r\n")
+        
         start = time.time()
-        output = ""
+        while True:
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                return False
+            output = self._read_until_prompt(remaining)
+            if not self._at_prompt:
+                return False
+            if reply.search(output):
+                return True
+    
+    def assert_prompt(self) -> bool:
+        """Check the shell is in step at a prompt, resyncing if it is not."""
+        if not self.ser or not self.ser.is_open:
+            return False
         
-        while (time.time() - start) < timeout:
-            if self.ser.in_waiting:
-                output += self.ser.read(self.ser.in_waiting).decode('utf-8', errors='replace')
-                if self.prompt in output:
-                    return True
-            time.sleep(0.1)
+        if self._probe(self.timeout):
+            return True
         
-        return False
+        log_info("Shell not in step, resyncing")
+        return self.sync()
     
     def sync(self) -> bool:
         """Synchronize with shell by sending empty command."""
         # Send a few newlines to get to a known state
-        for _ in range(3):
-            self.ser.write(b"\r\n")
-            time.sleep(0.1)
+        self.ser.write(b"\r\n\r\n\r\n")
         
-        self.ser.reset_input_buffer()
-        return self.wait_for_prompt(timeout=2.0)
+        # Their prompts arrive in no fixed time; the marker reply is the
+        # boundary the next command starts from
+        return self._probe(2.0)
+
+# ============================================================================
+# Replay Cache
+# ============================================================================
+
+def load_replay_cache(path: str) -> Dict[str, Dict[str, str]]:
+    """Load {firmware_sha: {test: "pass"}} from path, empty if unusable."""
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring replay cache {path}: {e}")
+        return {}
+    if not isinstance(cache, dict):
+        print(f"Ignoring replay cache {path}: not a JSON object")
+        return {}
+    # Drop hand-edited or stale entries instead of failing mid-run
+    return {fw: {name: outcome for name, outcome in tests.items()
+                 if isinstance(outcome, str)}
+            for fw, tests in cache.items() if isinstance(tests, dict)}
+
+def save_replay_cache(path: str, cache: Dict[str, Dict[str, str]]):
+    """Write the replay cache, replacing any previous contents."""
+    # Write aside and rename so an interrupted run cannot truncate the cache
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not write replay cache {path}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def replayable(name: str):
+    """Skip a test that already passed on the same firmware image.
+    
+    name is the test's display name, used both as its cache key and for
+    the skip line so it lines up with the pass/fail output.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(shell: "ESP32Shell") -> TestRecord:
+            passed = shell.replay_passed
+            if passed is None:
+                return func(shell)
+            
+            if passed.get(name) == PASS:
+                return log_skip(name, "passed before on this firmware")
+            
+            record = func(shell)
+            if record[1] == PASS:
+                passed[name] = PASS
+            return record
+        return wrapper
+    return decorator
 
 # ============================================================================
 # Test Functions
 # ============================================================================
 
-def test_connection(shell: ESP32Shell) -> bool:
+def test_connection(shell: ESP32Shell, fallback_baud: Optional[int] = None) -> TestRecord:
     """Test basic serial connection."""
-    results.run += 1
     
     if not shell.connect():
-        log_fail("Serial connection", f"Cannot open {shell.port}")
-        return False
+        return log_fail("Serial connection", f"Cannot open {shell.port}")
     
     # Try to sync with shell
     if shell.sync():
-        log_pass("Serial connection and shell sync")
-        return True
-    else:
-        log_fail("Shell sync", "No prompt received")
-        return False
+        return log_pass("Serial connection and shell sync")
+    
+    # Firmware built with the stock console rate ignores a faster --baud
+    if fallback_baud and fallback_baud != shell.baud:
+        log_info(f"No prompt at {shell.baud} baud, retrying at {fallback_baud}")
+        shell.set_baud(fallback_baud)
+        if shell.sync():
+            return log_pass(f"Serial connection and shell sync ({fallback_baud} baud)")
+    
+    return log_fail("Shell sync", "No prompt received")
 
-def test_echo(shell: ESP32Shell):
+@replayable("echo command")
+def test_echo(shell: ESP32Shell) -> TestRecord:
     """Test echo command."""
-    results.run += 1
     
     output = shell.send_command("echo hello world")
     
     if "hello world" in output:
-        log_pass("echo command")
+        return log_pass("echo command")
     else:
-        log_fail("echo command", f"Expected 'hello world', got: {repr(output)}")
+        return log_fail("echo command", f"Expected 'hello world', got: {repr(output)}")
 
-def test_pwd(shell: ESP32Shell):
+@replayable("pwd command")
+def test_pwd(shell: ESP32Shell) -> TestRecord:
     """Test pwd command."""
-    results.run += 1
     
     output = shell.send_command("pwd")
     
     # Should show /spiffs or similar
     if "/spiffs" in output or "/" in output:
-        log_pass("pwd command")
+        return log_pass("pwd command")
     else:
-        log_fail("pwd command", f"Expected path, got: {repr(output)}")
+        return log_fail("pwd command", f"Expected path, got: {repr(output)}")
 
-def test_ls(shell: ESP32Shell):
+@replayable("ls command")
+def test_ls(shell: ESP32Shell) -> TestRecord:
     """Test ls command."""
-    results.run += 1
     
     output = shell.send_command("ls")
     
     # ls should not error (output may be empty if no files)
-    if "error" in output.lower() or "Error" in output:
-        log_fail("ls command", f"Error in output: {repr(output)}")
+    if _RE_ERROR.search(output):
+        return log_fail("ls command", f"Error in output: {repr(output)}")
     else:
-        log_pass("ls command")
+        return log_pass("ls command")
 
-def test_help(shell: ESP32Shell):
+@replayable("help command")
+def test_help(shell: ESP32Shell) -> TestRecord:
     """Test help command."""
-    results.run += 1
     
-    output = shell.send_command("help", wait_time=1.0)
+    output = shell.send_command_cached("help", wait_time=1.0, cacheable=True)
     
     # Should list available commands
     if "echo" in output and "pwd" in output:
-        log_pass("help command")
+        return log_pass("help command")
     else:
-        log_fail("help command", f"Missing expected commands in: {repr(output[:200])}")
+        return log_fail("help command", f"Missing expected commands in: {repr(output[:200])}")
 
-def test_free(shell: ESP32Shell):
+@replayable("free command")
+def test_free(shell: ESP32Shell) -> TestRecord:
     """Test free memory command."""
-    results.run += 1
     
     output = shell.send_command("free")
     
     # Should show memory information
-    if "heap" in output.lower() or "bytes" in output.lower() or "free" in output.lower():
-        log_pass("free command")
+    if _RE_MEMORY.search(output):
+        return log_pass("free command")
     else:
-        log_fail("free command", f"Expected memory info, got: {repr(output)}")
+        return log_fail("free command", f"Expected memory info, got: {repr(output)}")
 
-def test_uptime(shell: ESP32Shell):
+@replayable("uptime command")
+def test_uptime(shell: ESP32Shell) -> TestRecord:
     """Test uptime command."""
-    results.run += 1
     
     output = shell.send_command("uptime")
     
     # Should show uptime info
-    if "up" in output.lower() or "second" in output.lower() or ":" in output:
-        log_pass("uptime command")
+    if _RE_UPTIME.search(output):
+        return log_pass("uptime command")
     else:
-        log_fail("uptime command", f"Expected uptime info, got: {repr(output)}")
+        return log_fail("uptime command", f"Expected uptime info, got: {repr(output)}")
 
-def test_info(shell: ESP32Shell):
+@replayable("info command")
+def test_info(shell: ESP32Shell) -> TestRecord:
     """Test system info command."""
-    results.run += 1
     
-    output = shell.send_command("info", wait_time=1.0)
+    output = shell.send_command_cached("info", wait_time=1.0, cacheable=True)
     
     # Should show chip/system info
-    if "esp32" in output.lower() or "chip" in output.lower() or "idf" in output.lower():
-        log_pass("info command")
+    if _RE_SYSINFO.search(output):
+        return log_pass("info command")
     else:
-        log_fail("info command", f"Expected system info, got: {repr(output)}")
+        return log_fail("info command", f"Expected system info, got: {repr(output)}")
 
-def test_variable_set_get(shell: ESP32Shell):
+@replayable("variable set/get")
+def test_variable_set_get(shell: ESP32Shell) -> TestRecord:
     """Test variable set and echo."""
-    results.run += 1
-    
-    # Set a variable
-    shell.send_command("set TESTVAR=hello123")
     
-    # Get it back via echo
-    output = shell.send_command("echo $TESTVAR")
+    # Set a variable and get it back via echo
+    output = shell.send_commands(["set TESTVAR=hello123", "echo $TESTVAR"])[1]
     
     if "hello123" in output:
-        log_pass("variable set/get")
+        return log_pass("variable set/get")
     else:
-        log_fail("variable set/get", f"Expected 'hello123', got: {repr(output)}")
+        return log_fail("variable set/get", f"Expected 'hello123', got: {repr(output)}")
 
-def test_env_command(shell: ESP32Shell):
+@replayable("env command")
+def test_env_command(shell: ESP32Shell) -> TestRecord:
     """Test env command."""
-    results.run += 1
-    
-    # Set a variable first
-    shell.send_command("set ENVTEST=value")
     
-    # List environment
-    output = shell.send_command("env")
+    # Set a variable first, then list environment
+    output = shell.send_commands(["set ENVTEST=value", "env"])[1]
     
     if "ENVTEST" in output or "=" in output:
-        log_pass("env command")
+        return log_pass("env command")
     else:
-        log_fail("env command", f"Expected variable listing, got: {repr(output)}")
+        return log_fail("env command", f"Expected variable listing, got: {repr(output)}")
 
-def test_unset_variable(shell: ESP32Shell):
+@replayable("unset command")
+def test_unset_variable(shell: ESP32Shell) -> TestRecord:
     """Test unset command."""
-    results.run += 1
     
-    # Set and unset
-    shell.send_command("set UNSETTEST=value")
-    shell.send_command("unset UNSETTEST")
-    
-    # Try to echo - should be empty
-    output = shell.send_command("echo $UNSETTEST")
+    # Set and unset, then try to echo - should be empty
+    output = shell.send_commands([
+        "set UNSETTEST=value",
+        "unset UNSETTEST",
+        "echo $UNSETTEST",
+    ])[2]
     
     # After unset, $UNSETTEST should expand to empty string
     if "value" not in output:
-        log_pass("unset command")
+        return log_pass("unset command")
     else:
-        log_fail("unset command", f"Variable still has value: {repr(output)}")
+        return log_fail("unset command", f"Variable still has value: {repr(output)}")
 
-def test_file_touch_rm(shell: ESP32Shell):
+@replayable("touch and rm commands")
+def test_file_touch_rm(shell: ESP32Shell) -> TestRecord:
     """Test touch and rm commands."""
-    results.run += 1
-    
-    # Create file
-    shell.send_command("touch /spiffs/testfile.txt")
     
-    # Check it exists
-    output = shell.send_command("ls /spiffs")
+    # Create file and check it exists
+    output = shell.send_commands(["touch /spiffs/testfile.txt", "ls /spiffs"])[1]
     
     if "testfile.txt" in output:
         # Now remove it
-        shell.send_command("rm /spiffs/testfile.txt")
-        output2 = shell.send_command("ls /spiffs")
+        output2 = shell.send_commands(["rm /spiffs/testfile.txt", "ls /spiffs"])[1]
         
         if "testfile.txt" not in output2:
-            log_pass("touch and rm commands")
+            return log_pass("touch and rm commands")
         else:
-            log_fail("rm command", "File still exists after rm")
+            return log_fail("rm command", "File still exists after rm")
     else:
-        log_fail("touch command", f"File not created: {repr(output)}")
+        return log_fail("touch command", f"File not created: {repr(output)}")
 
-def test_fsinfo(shell: ESP32Shell):
+@replayable("fsinfo command")
+def test_fsinfo(shell: ESP32Shell) -> TestRecord:
     """Test filesystem info command."""
-    results.run += 1
     
     output = shell.send_command("fsinfo")
     
     # Should show filesystem statistics
-    if "total" in output.lower() or "free" in output.lower() or "used" in output.lower():
-        log_pass("fsinfo command")
+    if _RE_FSINFO.search(output):
+        return log_pass("fsinfo command")
     else:
-        log_fail("fsinfo command", f"Expected filesystem info, got: {repr(output)}")
+        return log_fail("fsinfo command", f"Expected filesystem info, got: {repr(output)}")
 
-def test_gpio_read(shell: ESP32Shell):
+@replayable("gpio read command")
+def test_gpio_read(shell: ESP32Shell) -> TestRecord:
     """Test GPIO read command."""
-    results.run += 1
     
     # Read a safe GPIO pin (GPIO 0 is often safe to read)
     output = shell.send_command("gpio read 0")
     
     # Should return 0 or 1
     if "0" in output or "1" in output:
-        log_pass("gpio read command")
+        return log_pass("gpio read command")
     else:
-        log_fail("gpio read command", f"Expected 0 or 1, got: {repr(output)}")
+        return log_fail("gpio read command", f"Expected 0 or 1, got: {repr(output)}")
 
-def test_invalid_command(shell: ESP32Shell):
+@replayable("invalid command handling")
+def test_invalid_command(shell: ESP32Shell) -> TestRecord:
     """Test handling of invalid commands."""
-    results.run += 1
     
     output = shell.send_command("nonexistentcommand123")
     
     # Should show error or unknown command message
-    if "unknown" in output.lower() or "not found" in output.lower() or "error" in output.lower():
-        log_pass("invalid command handling")
+    if _RE_UNKNOWN_CMD.search(output):
+        return log_pass("invalid command handling")
     else:
         # Even if no error message, it shouldn't crash
-        log_pass("invalid command handling (no crash)")
+        return log_pass("invalid command handling (no crash)")
 
-def test_long_command(shell: ESP32Shell):
+@replayable("long command handling")
+def test_long_command(shell: ESP32Shell) -> TestRecord:
     """Test handling of long commands."""
-    results.run += 1
     
     # Create a command that exceeds 256 chars
     long_arg = "a" * 300
-    output = shell.send_command(f"echo {long_arg}")
     
     # Should either truncate or show error, but not crash
-    # If we get any response, it didn't crash
-    if output or True:  # Any response means it handled it
-        log_pass("long command handling (no crash)")
+    # The echoed output is not needed, only that the prompt comes back
+    if shell.send_command_discard(f"echo {long_arg}"):
+        return log_pass("long command handling (no crash)")
+    else:
+        return log_fail("long command handling", "No prompt after long command")
 
-def test_quoted_strings(shell: ESP32Shell):
+@replayable("quoted string handling")
+def test_quoted_strings(shell: ESP32Shell) -> TestRecord:
     """Test quoted string handling."""
-    results.run += 1
     
     output = shell.send_command('echo "hello world"')
     
     if "hello world" in output:
-        log_pass("quoted string handling")
+        return log_pass("quoted string handling")
     else:
-        log_fail("quoted string handling", f"Expected 'hello world', got: {repr(output)}")
+        return log_fail("quoted string handling", f"Expected 'hello world', got: {repr(output)}")
 
-def test_cd_command(shell: ESP32Shell):
+@replayable("cd command")
+def test_cd_command(shell: ESP32Shell) -> TestRecord:
     """Test cd command."""
-    results.run += 1
     
-    # Change to root and back
-    shell.send_command("cd /spiffs")
-    output = shell.send_command("pwd")
+    # Change directory, then check where we are
+    output = shell.send_commands(["cd /spiffs", "pwd"])[1]
     
     if "/spiffs" in output:
-        log_pass("cd command")
+        return log_pass("cd command")
     else:
-        log_fail("cd command", f"Expected /spiffs, got: {repr(output)}")
+        return log_fail("cd command", f"Expected /spiffs, got: {repr(output)}")
 
 # ============================================================================
 # Test Categories
 # ============================================================================
 
-def run_basic_tests(shell: ESP32Shell):
+def run_basic_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run basic command tests."""
     log_info("Running basic command tests...")
-    test_echo(shell)
-    test_pwd(shell)
-    test_ls(shell)
-    test_help(shell)
-    test_cd_command(shell)
-
-def run_system_tests(shell: ESP32Shell):
+    shell.assert_prompt()
+    records = [
+        test_echo(shell),
+        test_pwd(shell),
+        test_ls(shell),
+        test_help(shell),
+        test_cd_command(shell),
+    ]
+    flush_log()
+    return records
+
+def run_system_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run ESP32-specific system tests."""
     log_info("Running system command tests...")
-    test_free(shell)
-    test_uptime(shell)
-    test_info(shell)
-    test_fsinfo(shell)
-
-def run_variable_tests(shell: ESP32Shell):
+    shell.assert_prompt()
+    records = [
+        test_free(shell),
+        test_uptime(shell),
+        test_info(shell),
+        test_fsinfo(shell),
+    ]
+    flush_log()
+    return records
+
+def run_variable_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run environment variable tests."""
     log_info("Running variable tests...")
-    test_variable_set_get(shell)
-    test_env_command(shell)
-    test_unset_variable(shell)
-
-def run_file_tests(shell: ESP32Shell):
+    shell.assert_prompt()
+    records = [
+        test_variable_set_get(shell),
+        test_env_command(shell),
+        test_unset_variable(shell),
+    ]
+    flush_log()
+    return records
+
+def run_file_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run file operation tests."""
     log_info("Running file operation tests...")
-    test_file_touch_rm(shell)
-
-def run_gpio_tests(shell: ESP32Shell):
+    shell.assert_prompt()
+    records = [
+        test_file_touch_rm(shell),
+    ]
+    flush_log()
+    return records
+
+def run_gpio_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run GPIO tests."""
     log_info("Running GPIO tests...")
-    test_gpio_read(shell)
-
-def run_error_tests(shell: ESP32Shell):
+    shell.assert_prompt()
+    records = [
+        test_gpio_read(shell),
+    ]
+    flush_log()
+    return records
+
+def run_error_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run error handling tests."""
     log_info("Running error handling tests...")
-    test_invalid_command(shell)
-    test_long_command(shell)
-
-def run_parsing_tests(shell: ESP32Shell):
+    shell.assert_prompt()
+    records = [
+        test_invalid_command(shell),
+        test_long_command(shell),
+    ]
+    flush_log()
+    return records
+
+def run_parsing_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run parsing tests."""
     log_info("Running parsing tests...")
-    test_quoted_strings(shell)
-
-def run_all_tests(shell: ESP32Shell):
+    shell.assert_prompt()
+    records = [
+        test_quoted_strings(shell),
+    ]
+    flush_log()
+    return records
+
+def run_all_tests(shell: ESP32Shell) -> List[TestRecord]:
     """Run all tests."""
-    run_basic_tests(shell)
-    run_system_tests(shell)
-    run_variable_tests(shell)
-    run_file_tests(shell)
-    run_gpio_tests(shell)
-    run_error_tests(shell)
-    run_parsing_tests(shell)
+    return (run_basic_tests(shell)
+            + run_system_tests(shell)
+            + run_variable_tests(shell)
+            + run_file_tests(shell)
+            + run_gpio_tests(shell)
+            + run_error_tests(shell)
+            + run_parsing_tests(shell))
+
+TEST_CATEGORIES = {
+    "all": run_all_tests,
+    "basic": run_basic_tests,
+    "system": run_system_tests,
+    "variable": run_variable_tests,
+    "file": run_file_tests,
+    "gpio": run_gpio_tests,
+    "error": run_error_tests,
+    "parsing": run_parsing_tests,
+}
+
+def run_device(port: str, baud: int, timeout: float, test: str,
+               fallback_baud: Optional[int] = None,
+               wait_scale: float = 1.0,
+               replay: Optional[Dict[str, Dict[str, str]]] = None
+               ) -> Tuple[List[TestRecord], Dict[str, Dict[str, str]]]:
+    """Run one test category against the board on port.
+    
+    Returns the recorded outcomes plus this board's replay cache entry;
+    with several ports each call runs in its own worker process and the
+    caller folds them into TestResults.
+    """
+    shell = ESP32Shell(port, baud, timeout, wait_scale)
+    
+    # Test connection first
+    connection = test_connection(shell, fallback_baud)
+    records = [connection]
+    if connection[1] != PASS:
+        flush_log()
+        print(f"\n{Colors.RED}Cannot connect to {port}. Ensure ESP32 is running shell firmware.{Colors.NC}")
+        shell.disconnect()
+        return records, {}
+    
+    fw_hash = None
+    try:
+        if replay is not None:
+            fw_hash = shell.firmware_hash()
+            if fw_hash:
+                shell.replay_passed = dict(replay.get(fw_hash, {}))
+            else:
+                log_info("Firmware does not report App SHA256, replay cache disabled")
+        records += TEST_CATEGORIES[test](shell)
+    finally:
+        shell.disconnect()
+        flush_log()
+    
+    passed = {fw_hash: shell.replay_passed} if fw_hash and shell.replay_passed is not None else {}
+    return records, passed
 
 # ============================================================================
 # Main
@@ -478,13 +877,23 @@ Examples:
   python3 test_esp32_device.py /dev/ttyACM0
   python3 test_esp32_device.py /dev/ttyACM0 -t basic
   python3 test_esp32_device.py /dev/ttyACM0 -v --baud 115200
+  python3 test_esp32_device.py /dev/ttyACM0 /dev/ttyACM1 -t basic
 """
     )
-    parser.add_argument("port", help="Serial port (e.g., /dev/ttyACM0)")
-    parser.add_argument("-b", "--baud", type=int, default=115200, help="Baud rate (default: 115200)")
+    parser.add_argument("port", nargs="+",
+                        help="Serial port(s) (e.g., /dev/ttyACM0); boards are tested in parallel")
+    parser.add_argument("-b", "--baud", type=int, default=115200,
+                        help="Baud rate, must match CONSOLE_BAUD_RATE in the firmware (default: 115200)")
+    parser.add_argument("--fallback-baud", type=int, default=115200,
+                        help="Baud rate to retry at if --baud gets no prompt (default: 115200)")
     parser.add_argument("-t", "--test", default="all", help="Test category to run")
     parser.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
     parser.add_argument("--timeout", type=float, default=2.0, help="Serial timeout (default: 2.0)")
+    parser.add_argument("--replay-cache", metavar="PATH",
+                        help="JSON file of tests that passed per firmware image; skip them on reruns")
+    parser.add_argument("--wait-scale", type=float, default=1.0,
+                        help="Scale each command's prompt wait, max(--timeout, its wait time); "
+                             "sync windows are not scaled (default: 1.0)")
     
     args = parser.parse_args()
     
@@ -492,57 +901,66 @@ Examples:
     print("=" * 50)
     print("  ESP32 Shell - Serial Device Tests")
     print("=" * 50)
-    print(f"  Port: {args.port}")
+    print(f"  Port: {', '.join(args.port)}")
     print(f"  Baud: {args.baud}")
     print("=" * 50)
     print("")
     
-    # Create shell connection
-    shell = ESP32Shell(args.port, args.baud, args.timeout)
+    if args.test not in TEST_CATEGORIES:
+        print(f"Unknown test category: {args.test}")
+        return 1
     
-    # Test connection first
-    if not test_connection(shell):
-        print(f"\n{Colors.RED}Cannot connect to device. Ensure ESP32 is running shell firmware.{Colors.NC}")
+    if args.wait_scale <= 0:
+        print(f"--wait-scale must be positive, got {args.wait_scale}")
         return 1
     
-    # Run selected tests
-    try:
-        if args.test == "all":
-            run_all_tests(shell)
-        elif args.test == "basic":
-            run_basic_tests(shell)
-        elif args.test == "system":
-            run_system_tests(shell)
-        elif args.test == "variable":
-            run_variable_tests(shell)
-        elif args.test == "file":
-            run_file_tests(shell)
-        elif args.test == "gpio":
-            run_gpio_tests(shell)
-        elif args.test == "error":
-            run_error_tests(shell)
-        elif args.test == "parsing":
-            run_parsing_tests(shell)
-        else:
-            print(f"Unknown test category: {args.test}")
-            return 1
-    finally:
-        shell.disconnect()
+    ports = list(dict.fromkeys(args.port))
+    replay = load_replay_cache(args.replay_cache) if args.replay_cache else None
+    
+    if len(ports) == 1:
+        outcomes = [run_device(ports[0], args.baud, args.timeout, args.test,
+                               args.fallback_baud, args.wait_scale, replay)]
+    else:
+        # One process per board: each has its own serial port and records
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(ports)) as pool:
+            futures = [pool.submit(run_device, port, args.baud, args.timeout, args.test,
+                                   args.fallback_baud, args.wait_scale, replay)
+                       for port in ports]
+            outcomes = []
+            for port, future in zip(ports, futures):
+                # One bad board (e.g. unplugged mid-run) must not lose the others
+                try:
+                    outcomes.append(future.result())
+                except Exception as e:
+                    print(f"\n{Colors.RED}{port}: worker crashed: {e}{Colors.NC}")
+                    outcomes.append(([("worker crashed", FAIL, str(e))], {}))
+    
+    total = TestResults()
+    new_replay: Dict[str, Dict[str, str]] = {}
+    for port, (records, passed) in zip(ports, outcomes):
+        prefix = f"{port}: " if len(ports) > 1 else ""
+        total.merge(TestResults.from_records(records, prefix=prefix))
+        for fw_hash, tests in passed.items():
+            new_replay.setdefault(fw_hash, {}).update(tests)
+    
+    # Only firmware seen in this run is kept, so a rebuild invalidates it
+    if args.replay_cache and new_replay:
+        save_replay_cache(args.replay_cache, new_replay)
     
     # Print summary
     print("")
     print("=" * 50)
     print("  Test Summary")
     print("=" * 50)
-    print(f"  Tests run:    {Colors.BLUE}{results.run}{Colors.NC}")
-    print(f"  Passed:       {Colors.GREEN}{results.passed}{Colors.NC}")
-    print(f"  Failed:       {Colors.RED}{results.failed}{Colors.NC}")
-    print(f"  Skipped:      {Colors.YELLOW}{results.skipped}{Colors.NC}")
+    print(f"  Tests run:    {Colors.BLUE}{total.run}{Colors.NC}")
+    print(f"  Passed:       {Colors.GREEN}{total.passed}{Colors.NC}")
+    print(f"  Failed:       {Colors.RED}{total.failed}{Colors.NC}")
+    print(f"  Skipped:      {Colors.YELLOW}{total.skipped}{Colors.NC}")
     print("=" * 50)
     
-    if results.failed > 0:
+    if total.failed > 0:
         print(f"\n{Colors.RED}Failed tests:{Colors.NC}")
-        for failure in results.failures:
+        for failure in total.failures:
             print(f"  - {failure}")
         print(f"\n{Colors.RED}Some tests failed!{Colors.NC}")
         return 1